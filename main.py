@@ -1,8 +1,15 @@
 import os
+import re
+import queue
+import atexit
 import datetime
+import random
 from typing import Dict, List, Optional, Deque, Set
 from collections import deque, defaultdict
-from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from heapq import nlargest
+from itertools import chain, islice
+from operator import attrgetter, itemgetter
 import telebot
 from telebot import types
 from dotenv import load_dotenv
@@ -11,6 +18,7 @@ from ui.main_window import MainWindow
 import sqlite3
 import sys
 import threading
+import time
 
 
 
@@ -18,12 +26,61 @@ import threading
 load_dotenv()
 API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
-# Инициализация бота
-bot = telebot.TeleBot(API_TOKEN)
+# Инициализация бота: обработчики выполняются в пуле из BOT_WORKERS потоков
+BOT_WORKERS = 8
+bot = telebot.TeleBot(API_TOKEN, threaded=True, num_threads=BOT_WORKERS)
+
+_BY_START_DATE = attrgetter('start_date')
+_BY_END_DATE = attrgetter('end_date')
+
+# Кэш текущей даты: (дата, момент проверки по time.monotonic)
+_today_cache = (None, 0.0)
+
+def today_cached() -> datetime.date:
+    """Текущая дата, перечитываемая из системных часов не чаще раза в секунду"""
+    global _today_cache
+    today, checked_at = _today_cache
+    now = time.monotonic()
+    if today is None or now - checked_at > 1.0:
+        today = datetime.date.today()
+        _today_cache = (today, now)
+    return today
+
+DB_PATH = 'hotel.db'
+
+# Соединение с БД у каждого потока своё (бот, GUI, ...) и живёт до конца потока
+_db_local = threading.local()
+
+def get_db() -> sqlite3.Connection:
+    """Соединение текущего потока в режиме автокоммита; транзакции открываются явно"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        # Настройки уровня соединения; режим журнала хранится в самом файле и задаётся в init_db
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-65536')
+        _db_local.conn = conn
+    return conn
+
+# Сколько строк за раз забирать из курсора при загрузке
+LOAD_BATCH_SIZE = 1000
+
+def iter_rows(cursor: sqlite3.Cursor, sql: str):
+    """Выполняет запрос и отдаёт строки пачками по LOAD_BATCH_SIZE, не держа весь результат в памяти"""
+    cursor.execute(sql)
+    while True:
+        rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+        if not rows:
+            return
+        yield from rows
 
 def init_db():
-    conn = sqlite3.connect('hotel.db')
+    conn = get_db()
     cursor = conn.cursor()
+    # WAL: один fsync на коммит и чтение параллельно с записью
+    cursor.execute('PRAGMA journal_mode=WAL')
     
     # Создание таблиц
     cursor.execute('''
@@ -57,11 +114,111 @@ def init_db():
     )
     ''')
     
-    conn.commit()
-    conn.close()
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_guest ON bookings (guest_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_capsule ON bookings (capsule_id)')
 
 init_db()
 
+def run_in_transaction(conn: sqlite3.Connection, operations):
+    """Выполняет пары (sql, список параметров) одной транзакцией"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for sql, rows in operations:
+            conn.executemany(sql, rows)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+class WriteBatcher:
+    """Очередь записей в БД, которую отдельный поток сбрасывает пачками.
+
+    Каждый элемент очереди — список пар (sql, список параметров), который
+    всегда попадает в одну транзакцию. Получив первый элемент, поток ждёт
+    ещё до FLUSH_INTERVAL секунд или пока не наберётся BATCH_SIZE элементов,
+    склеивает подряд идущие одинаковые запросы в один executemany и
+    коммитит их вместе. Полная очередь блокирует отправителя.
+    """
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 0.05
+
+    def __init__(self, maxsize: int = 4096):
+        self._queue: "queue.Queue[list]" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, sql: str, params: tuple):
+        self.submit_many([(sql, [params])])
+
+    def submit_many(self, operations: List[tuple]):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put(operations)
+
+    def flush(self):
+        """Дожидается записи всего, что уже поставлено в очередь"""
+        self._queue.join()
+
+    def _run(self):
+        conn = get_db()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, batch)
+            except Exception as e:
+                print(f"Ошибка записи в БД: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _merge(batch: List[list]) -> List[tuple]:
+        merged: List[tuple] = []
+        for operations in batch:
+            for sql, rows in operations:
+                if merged and merged[-1][0] == sql:
+                    merged[-1][1].extend(rows)
+                else:
+                    merged.append((sql, list(rows)))
+        return merged
+
+    def _write(self, conn: sqlite3.Connection, batch: List[list]):
+        try:
+            run_in_transaction(conn, self._merge(batch))
+            return
+        except sqlite3.Error:
+            if len(batch) == 1:
+                raise
+        # Одна сбойная запись не должна откатывать чужие: повторяем по одной
+        for operations in batch:
+            try:
+                run_in_transaction(conn, operations)
+            except sqlite3.Error as e:
+                print(f"Ошибка записи в БД: {e}")
+
+
+_writer = WriteBatcher()
+
+def flush_writes():
+    """Дожидается, пока фоновый поток запишет все изменения в БД"""
+    _writer.flush()
+
+# Незаписанные изменения не должны теряться при выходе
+atexit.register(flush_writes)
+
 # ==================== ЗАДАНИЕ 1: Обработка исключений ====================
 class HotelBaseError(Exception):
     """Базовое исключение для отеля"""
@@ -83,25 +240,52 @@ class PaymentError(BookingError):
     """Ошибки оплаты"""
     pass
 
+# Отдельный генератор для цен капсул: ±10% к базовой цене типа
+_PRICE_RNG = random.Random()
+
+# Повторяющиеся фрагменты карточек: один объект строки на весь процесс
+STATUS_AVAILABLE = "🟢 Доступна"
+STATUS_TAKEN = "🔴 Занята"
+MARK_AVAILABLE = "🟢"
+MARK_TAKEN = "🔴"
+STATUS_PAID = "✅ Оплачено"
+STATUS_UNPAID = "❌ Не оплачено"
+MARK_PAID = "✅"
+MARK_UNPAID = "❌"
+
+# Формат дат в таблицах админ-панели
+DISPLAY_DATE_FORMAT = "%d.%m.%Y"
+
 # ==================== Базовые классы ====================
-class Entity(ABC):
-    """Абстрактный базовый класс для всех сущностей"""
-    @abstractmethod
+class Entity:
+    """Базовый класс для всех сущностей"""
+    __slots__ = ()
+
     def display_info(self) -> str:
-        """Абстрактный метод для отображения информации о сущности"""
-        pass
+        """Отображение информации о сущности, переопределяется в наследниках"""
+        raise NotImplementedError
 
-    @abstractmethod
-    def __str__(self) -> str:
-        pass
+class StoredMixin:
+    """Сохранение в БД для сущностей, у которых есть своя таблица.
 
-    @abstractmethod
-    def __repr__(self) -> str:
-        pass
+    Наследник задаёт _INSERT_SQL и _db_row.
+    """
+    __slots__ = ()
+    _INSERT_SQL = ''
+    
+    def _db_row(self) -> tuple:
+        """Значения для _INSERT_SQL"""
+        raise NotImplementedError
+    
+    def save_to_db(self):
+        """Ставит запись в очередь фонового потока записи"""
+        _writer.submit(self._INSERT_SQL, self._db_row())
 
 # ==================== ЗАДАНИЕ 3: Наследование ====================
 class BaseGuest(Entity):
     """Базовый класс гостя"""
+    __slots__ = ('guest_id', 'name')
+
     def __init__(self, guest_id: int, name: str):
         self.guest_id = guest_id
         self.name = name
@@ -121,6 +305,8 @@ class BaseGuest(Entity):
 
 class VIPGuest(BaseGuest):
     """Гость с VIP статусом"""
+    __slots__ = ('vip_level',)
+
     def __init__(self, guest_id: int, name: str, vip_level: int):
         super().__init__(guest_id, name)
         self.vip_level = vip_level
@@ -146,7 +332,7 @@ class VIPGuest(BaseGuest):
         return f"VIPGuest({self.guest_id}, '{self.name}', {self.vip_level})"
 
 # ==================== ЗАДАНИЕ 4: Защищённые атрибуты ====================
-class Capsule(Entity):
+class Capsule(StoredMixin, Entity):
     """Класс для представления капсулы в отеле"""
     TYPE_STANDARD = "Стандарт"
     TYPE_LUX = "Люкс"
@@ -158,22 +344,28 @@ class Capsule(Entity):
         TYPE_PREMIUM: 3500
     }
     
-    def __init__(self, capsule_id: int, capsule_type: str):
+    __slots__ = ('capsule_id', '_type', '_price_per_night', '_is_available', '_current_booking',
+                 '_str_cache', '_info_cache', '_price_str')
+    
+    def __init__(self, capsule_id: int, capsule_type: str, price_per_night: Optional[float] = None):
         self.capsule_id = capsule_id
-        self._type = capsule_type
-        self._price_per_night = self._calculate_price()
+        self._type = sys.intern(capsule_type)
+        if price_per_night is None:
+            price_per_night = self._calculate_price()
+        self._price_per_night = price_per_night
         self._is_available = True
         self._current_booking = None
+        self._str_cache: Optional[str] = None
+        self._info_cache: Optional[str] = None
+        self._price_str: Optional[str] = None
     
-    def save_to_db(self):
-        conn = sqlite3.connect('hotel.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT OR REPLACE INTO capsules (capsule_id, type, price_per_night, is_available)
-        VALUES (?, ?, ?, ?)
-        ''', (self.capsule_id, self._type, self._price_per_night, int(self._is_available)))
-        conn.commit()
-        conn.close()
+    _INSERT_SQL = '''
+    INSERT OR REPLACE INTO capsules (capsule_id, type, price_per_night, is_available)
+    VALUES (?, ?, ?, ?)
+    '''
+    
+    def _db_row(self) -> tuple:
+        return (self.capsule_id, self._type, self._price_per_night, int(self._is_available))
     
     @property
     def type(self):
@@ -183,6 +375,13 @@ class Capsule(Entity):
     def price_per_night(self):
         return self._price_per_night
     
+    @property
+    def price_str(self) -> str:
+        """Цена за ночь для таблиц; цена после создания не меняется"""
+        if self._price_str is None:
+            self._price_str = f"{self._price_per_night:.2f} руб."
+        return self._price_str
+    
     @property
     def is_available(self):
         return self._is_available
@@ -191,10 +390,16 @@ class Capsule(Entity):
     def current_booking(self):
         return self._current_booking
     
+    @classmethod
+    def base_price(cls, capsule_type: str) -> float:
+        """Базовая цена типа; неизвестный тип — ошибка, а не цена по умолчанию"""
+        try:
+            return cls.BASE_PRICES[capsule_type]
+        except KeyError:
+            raise CapsuleError(f"Неизвестный тип капсулы: {capsule_type}") from None
+    
     def _calculate_price(self) -> float:
-        base_price = self.BASE_PRICES.get(self._type, 1000)
-        import random
-        return base_price * (1 + random.uniform(-0.1, 0.1))
+        return self.base_price(self._type) * (0.9 + 0.2 * _PRICE_RNG.random())
     
     @staticmethod
     def get_available_types() -> List[str]:
@@ -205,235 +410,455 @@ class Capsule(Entity):
             raise CapsuleError("Капсула уже занята")
         self._is_available = False
         self._current_booking = booking
+        self._invalidate_cache()
     
     def release(self):
         self._is_available = True
         self._current_booking = None
+        self._invalidate_cache()
+    
+    def _invalidate_cache(self):
+        self._str_cache = None
+        self._info_cache = None
     
     def display_info(self) -> str:
-        status = "🟢 Доступна" if self._is_available else "🔴 Занята"
-        return (f"🚪 Капсула #{self.capsule_id}\n"
-                f"🏷 Тип: {self._type}\n"
-                f"💰 Цена за ночь: {self._price_per_night:.2f} руб.\n"
-                f"📌 Статус: {status}")
+        if self._info_cache is None:
+            status = STATUS_AVAILABLE if self._is_available else STATUS_TAKEN
+            self._info_cache = (f"🚪 Капсула #{self.capsule_id}\n"
+                                f"🏷 Тип: {self._type}\n"
+                                f"💰 Цена за ночь: {self._price_per_night:.2f} руб.\n"
+                                f"📌 Статус: {status}")
+        return self._info_cache
     
     def __str__(self):
-        status = "🟢" if self._is_available else "🔴"
-        return f"{status} Капсула #{self.capsule_id} ({self._type}) - {self._price_per_night:.2f} руб./ночь"
+        if self._str_cache is None:
+            status = MARK_AVAILABLE if self._is_available else MARK_TAKEN
+            self._str_cache = (f"{status} Капсула #{self.capsule_id} ({self._type}) - "
+                               f"{self._price_per_night:.2f} руб./ночь")
+        return self._str_cache
     
     def __repr__(self):
         return f"Capsule({self.capsule_id}, '{self._type}')"
 
-class Guest(BaseGuest):
+class Guest(StoredMixin, BaseGuest):
     """Класс для представления гостя отеля"""
-    _used_passports: Set[str] = set()
+    __slots__ = ('passport', 'phone', 'bookings', '_bookings_by_end', '_str_cache', '_info_cache',
+                 '_info_date')
     
     def __init__(self, guest_id: int, name: str, passport: str, phone: str):
         self.guest_id = guest_id
-        self.name = name
+        # Имена служат ключами статистики, интернирование экономит память на повторах
+        self.name = sys.intern(name)
         self.passport = passport
         self.phone = phone
-        self.bookings: List['Booking'] = []
-        
-        if passport in Guest._used_passports:
-            raise GuestError("Гость с таким паспортом уже зарегистрирован")
-        Guest._used_passports.add(passport)
-    
-    def save_to_db(self):
-        conn = sqlite3.connect('hotel.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT OR REPLACE INTO guests (guest_id, name, passport, phone)
-        VALUES (?, ?, ?, ?)
-        ''', (self.guest_id, self.name, self.passport, self.phone))
-        conn.commit()
-        conn.close()
+        self.bookings: Dict[int, 'Booking'] = {}
+        # Те же брони по дате выезда: активные — хвост списка от сегодняшнего дня
+        self._bookings_by_end: List['Booking'] = []
+        self._str_cache: Optional[str] = None
+        self._info_cache: Optional[str] = None
+        # Карточка содержит число активных броней и верна только для дня _info_date
+        self._info_date: Optional[datetime.date] = None
+    
+    _INSERT_SQL = '''
+    INSERT OR REPLACE INTO guests (guest_id, name, passport, phone)
+    VALUES (?, ?, ?, ?)
+    '''
+    
+    def _db_row(self) -> tuple:
+        return (self.guest_id, self.name, self.passport, self.phone)
     
     def add_booking(self, booking: 'Booking'):
-        self.bookings.append(booking)
+        self.bookings[booking.booking_id] = booking
+        insort(self._bookings_by_end, booking, key=_BY_END_DATE)
+        self._info_cache = None
     
     def remove_booking(self, booking: 'Booking'):
-        if booking in self.bookings:
-            self.bookings.remove(booking)
+        if self.bookings.pop(booking.booking_id, None) is None:
+            return
+        ordered = self._bookings_by_end
+        i = bisect_left(ordered, booking.end_date, key=_BY_END_DATE)
+        while ordered[i] is not booking:
+            i += 1
+        del ordered[i]
+        self._info_cache = None
     
-    def get_active_bookings(self) -> List['Booking']:
-        today = datetime.date.today()
-        return [b for b in self.bookings if b.end_date >= today]
+    def _first_active_index(self, today: Optional[datetime.date]) -> int:
+        if today is None:
+            today = today_cached()
+        return bisect_left(self._bookings_by_end, today, key=_BY_END_DATE)
+    
+    def get_active_bookings(self, today: Optional[datetime.date] = None) -> List['Booking']:
+        """Брони с выездом не раньше today, по дате выезда"""
+        return self._bookings_by_end[self._first_active_index(today):]
+    
+    def count_active_bookings(self, today: Optional[datetime.date] = None) -> int:
+        return len(self._bookings_by_end) - self._first_active_index(today)
     
     def display_info(self) -> str:
-        return (f"🏷 Гость #{self.guest_id}\n"
-                f"👤 Имя: {self.name}\n"
-                f"📄 Паспорт: {self.passport}\n"
-                f"📞 Телефон: {self.phone}\n"
-                f"🔢 Активных броней: {len(self.get_active_bookings())}")
+        today = today_cached()
+        if self._info_date != today:
+            self._info_cache = None
+            self._info_date = today
+        if self._info_cache is None:
+            active = self.count_active_bookings(today)
+            self._info_cache = (f"🏷 Гость #{self.guest_id}\n"
+                                f"👤 Имя: {self.name}\n"
+                                f"📄 Паспорт: {self.passport}\n"
+                                f"📞 Телефон: {self.phone}\n"
+                                f"🔢 Активных броней: {active}")
+        return self._info_cache
     
     def __str__(self):
-        return f"👤 #{self.guest_id} {self.name} (тел: {self.phone})"
+        if self._str_cache is None:
+            self._str_cache = f"👤 #{self.guest_id} {self.name} (тел: {self.phone})"
+        return self._str_cache
     
     def __repr__(self):
         return f"Guest({self.guest_id}, '{self.name}', '{self.passport}', '{self.phone}')"
 
-class Booking(Entity):
+class Booking(StoredMixin, Entity):
     """Класс для представления бронирования"""
-    _booking_history: Deque['Booking'] = deque(maxlen=1000)
-    
-    _booking_history: Deque['Booking'] = deque(maxlen=1000)
+    __slots__ = ('booking_id', 'guest', 'capsule', 'start_date', 'end_date', 'is_paid', '_total',
+                 '_str_cache', '_info_cache', '_start_date_str', '_end_date_str', '_total_str')
     
     def __init__(self, booking_id: int, guest: Guest, capsule: Capsule, 
-                 start_date: datetime.date, end_date: datetime.date):
+                 start_date: datetime.date, end_date: datetime.date,
+                 today: Optional[datetime.date] = None):
         if start_date >= end_date:
             raise BookingError("Дата выезда должна быть позже даты заезда")
         
+        self._assign(booking_id, guest, capsule, start_date, end_date, False)
+        self._validate_dates(today)
+        
+        self.capsule.book(self)
+        self.guest.add_booking(self)
+    
+    def _assign(self, booking_id: int, guest: Guest, capsule: Capsule,
+                start_date: datetime.date, end_date: datetime.date, is_paid: bool):
         self.booking_id = booking_id
         self.guest = guest
         self.capsule = capsule
         self.start_date = start_date
         self.end_date = end_date
-        self.is_paid = False
-        self._validate_dates()
-        
-        self.capsule.book(self)
-        self.guest.add_booking(self)
-        Booking._booking_history.append(self)
-        self.save_to_db()
+        self.is_paid = is_paid
+        # Даты и цена капсулы после создания не меняются, поэтому сумму считаем один раз
+        self._total = (end_date - start_date).days * capsule.price_per_night
+        self._str_cache: Optional[str] = None
+        self._info_cache: Optional[str] = None
+        # Строки для таблиц форматируются при первом обращении: strftime на каждую
+        # перерисовку ячейки заметно дороже чтения атрибута
+        self._start_date_str: Optional[str] = None
+        self._end_date_str: Optional[str] = None
+        self._total_str: Optional[str] = None
     
-    def save_to_db(self):
-        conn = sqlite3.connect('hotel.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT OR REPLACE INTO bookings 
-        (booking_id, guest_id, capsule_id, start_date, end_date, is_paid)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (self.booking_id, self.guest.guest_id, self.capsule.capsule_id, 
-              self.start_date.isoformat(), self.end_date.isoformat(), int(self.is_paid)))
-        conn.commit()
-        conn.close()
-    
-    def _validate_dates(self):
-        today = datetime.date.today()
+    @classmethod
+    def draft(cls, booking_id: int, guest: BaseGuest, capsule: Capsule,
+              start_date: datetime.date, end_date: datetime.date,
+              is_paid: bool = False) -> 'Booking':
+        """Бронирование только для расчёта и показа: капсула не занимается,
+        гость не меняется"""
+        booking = cls.__new__(cls)
+        booking._assign(booking_id, guest, capsule, start_date, end_date, is_paid)
+        return booking
+    
+    @classmethod
+    def _unchecked(cls, booking_id: int, guest: Guest, capsule: Capsule,
+                   start_date: datetime.date, end_date: datetime.date,
+                   is_paid: bool = False) -> 'Booking':
+        """Восстанавливает бронирование из доверенного источника (БД).
+
+        Даты не проверяются, капсула не занимается и строка не пишется
+        обратно в БД — этим занимается вызывающий код.
+        """
+        booking = cls.draft(booking_id, guest, capsule, start_date, end_date, is_paid)
+        guest.add_booking(booking)
+        return booking
+    
+    _INSERT_SQL = '''
+    INSERT OR REPLACE INTO bookings 
+    (booking_id, guest_id, capsule_id, start_date, end_date, is_paid)
+    VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    
+    def _db_row(self) -> tuple:
+        return (self.booking_id, self.guest.guest_id, self.capsule.capsule_id, 
+                self.start_date.isoformat(), self.end_date.isoformat(), int(self.is_paid))
+    
+    def delete_from_db(self):
+        _writer.submit('DELETE FROM bookings WHERE booking_id = ?', (self.booking_id,))
+    
+    def _validate_dates(self, today: Optional[datetime.date] = None):
+        if today is None:
+            today = today_cached()
         if self.start_date < today:
             raise BookingError("Дата заезда не может быть в прошлом")
         if (self.end_date - self.start_date).days > 30:
             raise BookingError("Максимальный срок бронирования - 30 дней")
     
-    @classmethod
-    def get_recent_bookings(cls, count: int = 5) -> List['Booking']:
-        return list(cls._booking_history)[-count:]
-    
     def calculate_total(self) -> float:
-        nights = (self.end_date - self.start_date).days
-        return nights * self.capsule.price_per_night
+        return self._total
+    
+    @property
+    def start_date_str(self) -> str:
+        if self._start_date_str is None:
+            self._start_date_str = self.start_date.strftime(DISPLAY_DATE_FORMAT)
+        return self._start_date_str
+    
+    @property
+    def end_date_str(self) -> str:
+        if self._end_date_str is None:
+            self._end_date_str = self.end_date.strftime(DISPLAY_DATE_FORMAT)
+        return self._end_date_str
+    
+    @property
+    def total_str(self) -> str:
+        if self._total_str is None:
+            self._total_str = f"{self._total:.2f} руб."
+        return self._total_str
     
     def mark_as_paid(self):
         if self.is_paid:
             raise PaymentError("Бронирование уже оплачено")
         self.is_paid = True
+        self._invalidate_cache()
     
     def cancel(self):
         if self.is_paid:
             raise PaymentError("Нельзя отменить оплаченное бронирование")
         self.capsule.release()
         self.guest.remove_booking(self)
+        self._invalidate_cache()
+    
+    def _invalidate_cache(self):
+        self._str_cache = None
+        self._info_cache = None
     
     def display_info(self) -> str:
-        paid_status = "✅ Оплачено" if self.is_paid else "❌ Не оплачено"
-        return (f"📝 Бронирование #{self.booking_id}\n"
-                f"👤 Гость: {self.guest.name} (#{self.guest.guest_id})\n"
-                f"🚪 Капсула: {self.capsule.type} (#{self.capsule.capsule_id})\n"
-                f"📅 Период: {self.start_date} - {self.end_date}\n"
-                f"💰 Сумма: {self.calculate_total():.2f} руб.\n"
-                f"📌 Статус оплаты: {paid_status}")
+        if self._info_cache is None:
+            paid_status = STATUS_PAID if self.is_paid else STATUS_UNPAID
+            self._info_cache = (f"📝 Бронирование #{self.booking_id}\n"
+                                f"👤 Гость: {self.guest.name} (#{self.guest.guest_id})\n"
+                                f"🚪 Капсула: {self.capsule.type} (#{self.capsule.capsule_id})\n"
+                                f"📅 Период: {self.start_date} - {self.end_date}\n"
+                                f"💰 Сумма: {self.calculate_total():.2f} руб.\n"
+                                f"📌 Статус оплаты: {paid_status}")
+        return self._info_cache
     
     def __str__(self):
-        paid_status = "✅" if self.is_paid else "❌"
-        return f"{paid_status} Бронь #{self.booking_id}"
+        if self._str_cache is None:
+            paid_status = MARK_PAID if self.is_paid else MARK_UNPAID
+            self._str_cache = f"{paid_status} Бронь #{self.booking_id}"
+        return self._str_cache
     
     def __repr__(self):
         return (f"Booking({self.booking_id}, {repr(self.guest)}, "
                 f"{repr(self.capsule)}, {self.start_date}, {self.end_date})")
 
 # ==================== ЗАДАНИЕ 2: Работа с массивами объектов ====================
+# Сколько последних бронирований помнит история для /recent
+RECENT_HISTORY_SIZE = 1000
+
+def _move_id(source: List[int], target: List[int], item_id: int):
+    """Переносит ID между двумя упорядоченными списками"""
+    i = bisect_left(source, item_id)
+    if i < len(source) and source[i] == item_id:
+        del source[i]
+    i = bisect_left(target, item_id)
+    if i == len(target) or target[i] != item_id:
+        target.insert(i, item_id)
+
 class Hotel:
     """Класс для представления отеля"""
+    __slots__ = ('name', 'guests', 'capsules', 'bookings', '_passports',
+                 '_available_capsule_ids', '_occupied_capsule_ids', '_capsules_by_type', '_bookings_sorted',
+                 '_paid_ids', '_recent_ids', '_lock', '_stats_cache',
+                 '_next_guest_id', '_next_capsule_id', '_next_booking_id')
+
     def __init__(self, name: str = "My Hotel"):
         self.name = name
         self.guests: Dict[int, Guest] = {}
         self.capsules: Dict[int, Capsule] = {}
         self.bookings: Dict[int, Booking] = {}
+        self._passports: Set[str] = set()
+        self._lock = threading.Lock()
+        # ID капсул, свободных прямо сейчас (без текущего бронирования), и остальных;
+        # оба списка упорядочены по ID, каждая капсула ровно в одном из них
+        self._available_capsule_ids: List[int] = []
+        self._occupied_capsule_ids: List[int] = []
+        # Тип -> капсулы этого типа по возрастанию ID
+        self._capsules_by_type: Dict[str, List[Capsule]] = defaultdict(list)
+        # Бронирования по дате заезда (при равных датах — в порядке создания)
+        self._bookings_sorted: List[Booking] = []
+        # ID оплаченных бронирований
+        self._paid_ids: Set[int] = set()
+        # ID последних созданных бронирований для /recent. Храним ID, а не снимки:
+        # показ берёт бронь из self.bookings, так что оплата видна сразу, а
+        # выселенные брони пропускаются и не удерживаются в памяти
+        self._recent_ids: Deque[int] = deque(maxlen=RECENT_HISTORY_SIZE)
+        # Итоги /stats; сбрасываются при создании и выселении бронирований
+        self._stats_cache: Optional[Dict[str, float]] = None
         self._next_guest_id = 1
         self._next_capsule_id = 1
         self._next_booking_id = 1
         self._load_from_db()
     
     def _load_from_db(self):
+        # Сначала дописываем отложенные изменения, затем читаем все таблицы
+        # в одной транзакции, чтобы видеть согласованный снимок
+        flush_writes()
+        conn = get_db()
+        conn.execute('BEGIN')
+        try:
+            self._load_rows(conn.cursor())
+        finally:
+            conn.execute('COMMIT')
+    
+    def _load_rows(self, cursor: sqlite3.Cursor):
+        # Строки идут по возрастанию ID, поэтому следующий ID — последний прочитанный + 1
         # Загрузка гостей
-        conn = sqlite3.connect('hotel.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT MAX(guest_id) FROM guests')
-        max_id = cursor.fetchone()[0]
-        self._next_guest_id = max_id + 1 if max_id else 1
-        
-        cursor.execute('SELECT * FROM guests')
-        for row in cursor.fetchall():
+        last_id = 0
+        for row in iter_rows(cursor, 'SELECT guest_id, name, passport, phone FROM guests ORDER BY guest_id'):
+            last_id = row[0]
             guest = Guest(row[0], row[1], row[2], row[3])
             self.guests[guest.guest_id] = guest
+            self._passports.add(guest.passport)
+        self._next_guest_id = last_id + 1
         
         # Загрузка капсул
-        cursor.execute('SELECT MAX(capsule_id) FROM capsules')
-        max_id = cursor.fetchone()[0]
-        self._next_capsule_id = max_id + 1 if max_id else 1
-        
-        cursor.execute('SELECT * FROM capsules')
-        for row in cursor.fetchall():
-            capsule = Capsule(row[0], row[1])
-            capsule._price_per_night = row[2]
+        last_id = 0
+        for row in iter_rows(cursor, 'SELECT capsule_id, type, price_per_night, is_available '
+                                     'FROM capsules ORDER BY capsule_id'):
+            last_id = row[0]
+            capsule = Capsule(row[0], row[1], row[2])
             capsule._is_available = bool(row[3])
             self.capsules[capsule.capsule_id] = capsule
+            self._capsules_by_type[capsule.type].append(capsule)
+        self._next_capsule_id = last_id + 1
         
         # Загрузка бронирований
-        cursor.execute('SELECT MAX(booking_id) FROM bookings')
-        max_id = cursor.fetchone()[0]
-        self._next_booking_id = max_id + 1 if max_id else 1
-        
-        cursor.execute('SELECT * FROM bookings')
-        for row in cursor.fetchall():
+        last_id = 0
+        today = today_cached()
+        for row in iter_rows(cursor, 'SELECT booking_id, guest_id, capsule_id, start_date, end_date, is_paid '
+                                     'FROM bookings ORDER BY booking_id'):
+            last_id = row[0]
             guest = self.guests.get(row[1])
             capsule = self.capsules.get(row[2])
             if guest and capsule:
                 start_date = datetime.date.fromisoformat(row[3])
                 end_date = datetime.date.fromisoformat(row[4])
-                booking = Booking(row[0], guest, capsule, start_date, end_date)
-                booking.is_paid = bool(row[5])
+                booking = Booking._unchecked(row[0], guest, capsule, start_date, end_date, bool(row[5]))
                 self.bookings[booking.booking_id] = booking
-                if not booking.is_paid and end_date >= datetime.date.today():
+                self._index_booking(booking)
+                if not booking.is_paid and end_date >= today:
                     capsule._is_available = False
                     capsule._current_booking = booking
+        self._next_booking_id = last_id + 1
+        # В историю попадают только последние RECENT_HISTORY_SIZE броней
+        recent = list(islice(reversed(self.bookings), RECENT_HISTORY_SIZE))
+        recent.reverse()
+        self._recent_ids.extend(recent)
         
-        conn.close()
+        self._available_capsule_ids = [capsule_id for capsule_id, capsule in self.capsules.items()
+                                       if capsule.is_available]
+        self._occupied_capsule_ids = [capsule_id for capsule_id, capsule in self.capsules.items()
+                                      if not capsule.is_available]
+    
+    def _index_booking(self, booking: Booking):
+        """Добавляет бронирование в список по дате заезда и, если оно оплачено,
+        в множество оплаченных"""
+        insort(self._bookings_sorted, booking, key=_BY_START_DATE)
+        if booking.is_paid:
+            self._paid_ids.add(booking.booking_id)
+    
+    def _unindex_booking(self, booking: Booking):
+        """Убирает бронирование из списка по дате заезда (двоичный поиск по дате,
+        затем поиск именно этого объекта среди броней того же дня) и из оплаченных"""
+        ordered = self._bookings_sorted
+        i = bisect_left(ordered, booking.start_date, key=_BY_START_DATE)
+        while ordered[i] is not booking:
+            i += 1
+        del ordered[i]
+        self._paid_ids.discard(booking.booking_id)
+    
+    def bookings_by_start_date(self) -> List[Booking]:
+        """Бронирования, упорядоченные по дате заезда; список только для чтения"""
+        return self._bookings_sorted
+    
+    def bookings_starting_between(self, first: datetime.date, last: datetime.date) -> List[Booking]:
+        """Бронирования с заездом в [first, last]: срез упорядоченного списка
+        по двум двоичным поискам, без просмотра остальных"""
+        ordered = self._bookings_sorted
+        lo = bisect_left(ordered, first, key=_BY_START_DATE)
+        hi = bisect_right(ordered, last, lo=lo, key=_BY_START_DATE)
+        return ordered[lo:hi]
+    
+    def paid_booking_ids(self) -> Set[int]:
+        """ID оплаченных бронирований; множество только для чтения"""
+        return self._paid_ids
     
     def _initialize_sample_data(self):
-        for _ in range(3):
-            self.add_capsule(Capsule.TYPE_STANDARD)
-        for _ in range(2):
-            self.add_capsule(Capsule.TYPE_LUX)
+        self.add_capsules_bulk(Capsule.TYPE_STANDARD, 3)
+        self.add_capsules_bulk(Capsule.TYPE_LUX, 2)
         self.add_capsule(Capsule.TYPE_PREMIUM)
         
         self.register_guest("Иван Иванов", "1234567890", "+79123456789")
         self.register_guest("Петр Петров", "0987654321", "+79098765432")
     
+    def bulk_save(self, entities):
+        """Сохраняет сущности одной транзакцией, по одному executemany на таблицу"""
+        rows_by_sql: Dict[str, List[tuple]] = {}
+        for entity in entities:
+            rows_by_sql.setdefault(entity._INSERT_SQL, []).append(entity._db_row())
+        if rows_by_sql:
+            _writer.submit_many(list(rows_by_sql.items()))
+    
     def add_capsule(self, capsule_type: str) -> Capsule:
-        capsule = Capsule(self._next_capsule_id, capsule_type)
-        self.capsules[self._next_capsule_id] = capsule
-        self._next_capsule_id += 1
+        capsule = self._new_capsule(capsule_type)
+        capsule.save_to_db()
+        return capsule
+    
+    def _new_capsule(self, capsule_type: str) -> Capsule:
+        """Создаёт и регистрирует капсулу, не сохраняя её в БД"""
+        with self._lock:
+            capsule = Capsule(self._next_capsule_id, capsule_type)
+            self.capsules[self._next_capsule_id] = capsule
+            # ID выдаются по возрастанию, поэтому добавление в конец сохраняет порядок
+            self._available_capsule_ids.append(capsule.capsule_id)
+            self._capsules_by_type[capsule.type].append(capsule)
+            self._next_capsule_id += 1
         return capsule
     
+    def add_capsules_bulk(self, capsule_type: str, count: int) -> List[Capsule]:
+        """Добавляет несколько капсул одного типа, разыгрывая цены одним проходом"""
+        base_price = Capsule.base_price(capsule_type)
+        rand = _PRICE_RNG.random
+        with self._lock:
+            first_id = self._next_capsule_id
+            capsules = []
+            for capsule_id in range(first_id, first_id + count):
+                capsule = Capsule(capsule_id, capsule_type, base_price * (0.9 + 0.2 * rand()))
+                self.capsules[capsule_id] = capsule
+                capsules.append(capsule)
+            self._available_capsule_ids.extend(range(first_id, first_id + count))
+            self._capsules_by_type[capsule_type].extend(capsules)
+            self._next_capsule_id = first_id + count
+        self.bulk_save(capsules)
+        return capsules
+    
     def register_guest(self, name: str, passport: str, phone: str) -> Guest:
-        name = ' '.join(part.capitalize() for part in name.split())
+        # str.title() здесь не подходит: он поднимает букву и после дефиса ("Анна-Мария")
+        name = ' '.join(map(str.capitalize, name.split()))
         
-        guest = Guest(self._next_guest_id, name, passport, phone)
-        self.guests[self._next_guest_id] = guest
-        self._next_guest_id += 1
+        # Проверка паспорта и выдача ID должны быть атомарными: /register
+        # из разных чатов обрабатывается параллельно
+        with self._lock:
+            if passport in self._passports:
+                raise GuestError("Гость с таким паспортом уже зарегистрирован")
+            guest = Guest(self._next_guest_id, name, passport, phone)
+            self._passports.add(passport)
+            self.guests[self._next_guest_id] = guest
+            self._next_guest_id += 1
+        guest.save_to_db()
         return guest
     
     def create_booking(self, guest_id: int, capsule_id: int, 
@@ -446,306 +871,456 @@ class Hotel:
         guest = self.guests[guest_id]
         capsule = self.capsules[capsule_id]
         
-        booking = Booking(self._next_booking_id, guest, capsule, start_date, end_date)
-        self.bookings[self._next_booking_id] = booking
-        self._next_booking_id += 1
+        today = today_cached()
+        # Обработчики бота работают в пуле потоков: выдача ID, занятие капсулы,
+        # обновление индексов и постановка записи в очередь — одна атомарная операция
+        with self._lock:
+            booking = Booking(self._next_booking_id, guest, capsule, start_date, end_date, today)
+            self.bookings[self._next_booking_id] = booking
+            self._index_booking(booking)
+            _move_id(self._available_capsule_ids, self._occupied_capsule_ids, capsule_id)
+            self._next_booking_id += 1
+            self._recent_ids.append(booking.booking_id)
+            self._stats_cache = None
+            booking.save_to_db()
         return booking
     
-    def get_available_capsules(self, date: Optional[datetime.date] = None) -> List[Capsule]:
-        if date is None:
-            date = datetime.date.today()
-        
-        available = []
-        for capsule in self.capsules.values():
-            if capsule.is_available or (capsule.current_booking and 
-                                     not (capsule.current_booking.start_date <= date <= capsule.current_booking.end_date)):
-                available.append(capsule)
-        return available
+    def get_available_capsules(self) -> List[Capsule]:
+        """Капсулы, которые можно забронировать прямо сейчас: без текущего бронирования.
+
+        Капсула с будущей бронью сюда не входит — у неё уже есть текущее бронирование.
+        """
+        return self.capsules_by_availability(True)
+    
+    def capsules_by_availability(self, available: bool) -> List[Capsule]:
+        """Свободные или занятые сейчас капсулы по возрастанию ID, без просмотра остальных"""
+        capsules = self.capsules
+        with self._lock:
+            ids = self._available_capsule_ids if available else self._occupied_capsule_ids
+            return [capsules[capsule_id] for capsule_id in ids]
+    
+    # Обработчики бота работают в пуле потоков, а брони и капсулы меняются под
+    # self._lock: перебирать словари можно только по копии, снятой под ней же
+    def guests_snapshot(self) -> List[Guest]:
+        """Гости на текущий момент, по возрастанию ID"""
+        with self._lock:
+            return list(self.guests.values())
+    
+    def capsules_snapshot(self) -> List[Capsule]:
+        """Капсулы на текущий момент, по возрастанию ID"""
+        with self._lock:
+            return list(self.capsules.values())
+    
+    def bookings_snapshot(self) -> List[Booking]:
+        """Бронирования на текущий момент, по возрастанию ID"""
+        with self._lock:
+            return list(self.bookings.values())
+    
+    def get_recent_bookings(self, count: int = 5) -> List[Booking]:
+        """Последние созданные и ещё не выселенные бронирования, от старых к новым"""
+        bookings = self.bookings
+        recent = []
+        with self._lock:
+            for booking_id in reversed(self._recent_ids):
+                booking = bookings.get(booking_id)
+                if booking is not None:
+                    recent.append(booking)
+                    if len(recent) == count:
+                        break
+        recent.reverse()
+        return recent
+    
+    def capsules_of_type(self, capsule_type: str) -> List[Capsule]:
+        """Капсулы одного типа по возрастанию ID; список только для чтения"""
+        return self._capsules_by_type.get(capsule_type, [])
+    
+    def mark_booking_paid(self, booking_id: int) -> Booking:
+        with self._lock:
+            booking = self.bookings.get(booking_id)
+            if booking is None:
+                raise BookingError("Бронирование не найдено")
+            
+            booking.mark_as_paid()
+            self._paid_ids.add(booking_id)
+            booking.save_to_db()
+        return booking
     
     def check_out(self, booking_id: int):
-        if booking_id not in self.bookings:
-            raise BookingError("Бронирование не найдено")
-        
-        booking = self.bookings[booking_id]
-        booking.cancel()
-        del self.bookings[booking_id]
+        # Проверка и снятие брони под той же блокировкой, что и create_booking:
+        # иначе два выселения одной брони или выселение во время бронирования
+        # рассинхронизируют индексы
+        with self._lock:
+            booking = self.bookings.get(booking_id)
+            if booking is None:
+                raise BookingError("Бронирование не найдено")
+            
+            booking.cancel()
+            self._unindex_booking(booking)
+            _move_id(self._occupied_capsule_ids, self._available_capsule_ids, booking.capsule.capsule_id)
+            del self.bookings[booking_id]
+            self._stats_cache = None
+            booking.delete_from_db()
     
     def get_guest_statistics(self) -> Dict[str, float]:
-        stats = defaultdict(float)
-        for booking in self.bookings.values():
-            stats[booking.guest.name] += booking.calculate_total()
-        return stats
+        # Кэш строится под той же блокировкой, под которой create_booking и check_out
+        # меняют брони и сбрасывают его: иначе итог без новой брони мог бы
+        # сохраниться после сброса, а обход словаря — упасть на его изменении
+        with self._lock:
+            stats = self._stats_cache
+            if stats is None:
+                stats = {}
+                get = stats.get
+                for booking in self.bookings.values():
+                    name = booking.guest.name
+                    stats[name] = get(name, 0.0) + booking.calculate_total()
+                self._stats_cache = stats
+            return dict(stats)
     
     # ==================== Методы для задания 2 ====================
     def find_guest_with_max_bookings(self) -> Optional[Guest]:
         """Находит гостя с максимальным количеством бронирований"""
-        if not self.guests:
-            return None
-        return max(self.guests.values(), key=lambda g: len(g.bookings))
+        return max(self.guests_snapshot(), key=lambda g: len(g.bookings), default=None)
     
     def find_capsule_with_max_price(self, capsules_2d: List[List[Capsule]]) -> Optional[Capsule]:
         """Находит капсулу с максимальной ценой в 2D списке"""
-        if not capsules_2d or not any(capsules_2d):
-            return None
-            
-        max_capsule = None
-        max_price = 0
-        
-        for row in capsules_2d:
-            for capsule in row:
-                if capsule.price_per_night > max_price:
-                    max_price = capsule.price_per_night
-                    max_capsule = capsule
-        
-        return max_capsule
+        return max(chain.from_iterable(capsules_2d), key=attrgetter('price_per_night'), default=None)
+    
+    # Тип капсулы в get_capsules_2d зависит только от (i + j) % 15 (НОК 3 и 5)
+    _GRID_TYPES = tuple(Capsule.TYPE_LUX if k % 3 == 0 else
+                        Capsule.TYPE_PREMIUM if k % 5 == 0 else
+                        Capsule.TYPE_STANDARD
+                        for k in range(15))
     
     def get_capsules_2d(self, rows: int, cols: int) -> List[List[Capsule]]:
         """Создает 2D список капсул"""
-        capsules = []
-        for i in range(rows):
-            row = []
-            for j in range(cols):
-                capsule_type = Capsule.TYPE_STANDARD
-                if (i + j) % 3 == 0:
-                    capsule_type = Capsule.TYPE_LUX
-                elif (i + j) % 5 == 0:
-                    capsule_type = Capsule.TYPE_PREMIUM
-                capsule = self.add_capsule(capsule_type)
-                row.append(capsule)
-            capsules.append(row)
+        grid_types = self._GRID_TYPES
+        new_capsule = self._new_capsule
+        capsules = [[new_capsule(grid_types[(i + j) % 15]) for j in range(cols)]
+                    for i in range(rows)]
+        self.bulk_save(chain.from_iterable(capsules))
         return capsules
 
 # Инициализация отеля
 hotel = Hotel("Капсульный отель 'Космос'")
 
-# Состояния для FSM (имитация)
-user_states = {}
+# Состояния для FSM (имитация): chat_id -> (момент последнего шага, данные диалога).
+# Обработчики telebot работают в пуле потоков, поэтому доступ только под блокировкой
+user_states: Dict[int, tuple] = {}
+_states_lock = threading.Lock()
+# Через сколько секунд брошенный диалог забывается
+STATE_TTL = 30 * 60
+
+def _evict_stale_states(now: float):
+    stale = [chat_id for chat_id, (touched, _) in user_states.items() if now - touched > STATE_TTL]
+    for chat_id in stale:
+        del user_states[chat_id]
+
+def start_state(chat_id: int, **data) -> dict:
+    """Начинает новый диалог для чата, заменяя незавершённый"""
+    now = time.monotonic()
+    with _states_lock:
+        _evict_stale_states(now)
+        user_states[chat_id] = (now, data)
+        return dict(data)
+
+def update_state(chat_id: int, **data) -> dict:
+    """Дополняет данные диалога и возвращает их копию.
+
+    KeyError, если диалога нет или он устарел.
+    """
+    now = time.monotonic()
+    with _states_lock:
+        touched, state = user_states[chat_id]
+        if now - touched > STATE_TTL:
+            del user_states[chat_id]
+            raise KeyError(chat_id)
+        state.update(data)
+        user_states[chat_id] = (now, state)
+        return dict(state)
+
+def finish_state(chat_id: int):
+    """Завершает диалог чата"""
+    with _states_lock:
+        user_states.pop(chat_id, None)
+
+# Сколько гостей показывать в /stats
+STATS_TOP_N = 20
+
+# Ответы отправляют BOT_WORKERS фоновых потоков, чтобы обработчик не ждал HTTPS-запрос
+# к Telegram. Чат всегда попадает в одну и ту же очередь, поэтому ответы в нём
+# уходят по порядку. telebot держит сессию requests на поток, так что соединение переиспользуется
+_send_queues: "List[queue.Queue[tuple]]" = [queue.Queue() for _ in range(BOT_WORKERS)]
+_sender_lock = threading.Lock()
+_senders_started = False
+
+def _sender_loop(send_queue: "queue.Queue[tuple]"):
+    while True:
+        chat_id, text, reply_to_id = send_queue.get()
+        try:
+            bot.send_message(chat_id, text, reply_to_message_id=reply_to_id)
+        except Exception as e:
+            print(f"Ошибка отправки сообщения в чат {chat_id}: {e}")
+        finally:
+            send_queue.task_done()
+
+def _start_senders():
+    global _senders_started
+    with _sender_lock:
+        if _senders_started:
+            return
+        for i, send_queue in enumerate(_send_queues):
+            threading.Thread(target=_sender_loop, args=(send_queue,),
+                             name=f"telegram-sender-{i}", daemon=True).start()
+        _senders_started = True
+
+def reply(message, text: str):
+    """Ставит ответ на сообщение в очередь отправки его чата"""
+    if not _senders_started:
+        _start_senders()
+    chat_id = message.chat.id
+    _send_queues[hash(chat_id) % BOT_WORKERS].put((chat_id, text, message.message_id))
+
+def flush_replies():
+    """Дожидается отправки всех ответов из очередей"""
+    for send_queue in _send_queues:
+        send_queue.join()
+
+# Ответы, поставленные перед выходом, не теряются вместе с фоновыми потоками
+atexit.register(flush_replies)
+
+# Неизменные тексты ответов собираются один раз при загрузке модуля
+WELCOME_TEXT = (
+    "🏨 Добро пожаловать в систему управления капсульным отелем!\n\n"
+    "Доступные команды:\n"
+    "/guests - Список гостей\n"
+    "/register - Зарегистрировать нового гостя\n"
+    "/capsules - Список капсул\n"
+    "/book - Создать бронирование\n"
+    "/bookings - Список бронирований\n"
+    "/checkout - Выселить гостя\n"
+    "/stats - Статистика по гостям\n"
+    "/recent - Последние бронирования\n"
+    "/max_guest - Гость с макс. бронированиями\n"
+    "/demo_vip - Демо VIP гостя"
+)
+GUESTS_HEADER = "👥 Выберите гостя (введите ID):\n\n"
+CAPSULES_HEADER = "🚪 Выберите капсулу (введите ID):\n\n"
+DATE_FORMAT_ERROR = "❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД."
+DIALOG_EXPIRED = "⌛ Диалог устарел, начните заново."
+
+def continue_state(message, **data) -> Optional[dict]:
+    """update_state для шага диалога: если диалог забыт по STATE_TTL,
+    сообщает об этом пользователю и возвращает None"""
+    try:
+        return update_state(message.chat.id, **data)
+    except KeyError:
+        reply(message, DIALOG_EXPIRED)
+        return None
 
-# ==================== Обработчики команд бота ====================
-@bot.message_handler(commands=['start', 'help'])
-def send_welcome(message):
-    bot.reply_to(
-        message,
-        "🏨 Добро пожаловать в систему управления капсульным отелем!\n\n"
-        "Доступные команды:\n"
-        "/guests - Список гостей\n"
-        "/register - Зарегистрировать нового гостя\n"
-        "/capsules - Список капсул\n"
-        "/book - Создать бронирование\n"
-        "/bookings - Список бронирований\n"
-        "/checkout - Выселить гостя\n"
-        "/stats - Статистика по гостям\n"
-        "/recent - Последние бронирования\n"
-        "/max_guest - Гость с макс. бронированиями\n"
-        "/demo_vip - Демо VIP гостя"
-    )
+_ISO_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
-# ... (остальные обработчики команд остаются без изменений, кроме добавления обработки исключений)
+def parse_iso_date(text: Optional[str]) -> Optional[datetime.date]:
+    """Разбирает дату ГГГГ-ММ-ДД, возвращая None для некорректного ввода"""
+    if not text or not _ISO_DATE_RE.match(text):
+        return None
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:  # формат верный, но такой даты нет (например, 2024-02-30)
+        return None
 
+# ==================== Обработчики команд бота ====================
 @bot.message_handler(commands=['start', 'help'])
 def send_welcome(message):
-    bot.reply_to(
-        message,
-        "🏨 Добро пожаловать в систему управления капсульным отелем!\n\n"
-        "Доступные команды:\n"
-        "/guests - Список гостей\n"
-        "/register - Зарегистрировать нового гостя\n"
-        "/capsules - Список капсул\n"
-        "/book - Создать бронирование\n"
-        "/bookings - Список бронирований\n"
-        "/checkout - Выселить гостя\n"
-        "/stats - Статистика по гостям\n"
-        "/recent - Последние бронирования"
-    )
+    reply(message, WELCOME_TEXT)
 
 
 @bot.message_handler(commands=['guests'])
 def list_guests(message):
-    if not hotel.guests:
-        bot.reply_to(message, "В отеле пока нет гостей.")
+    guests = hotel.guests_snapshot()
+    if not guests:
+        reply(message, "В отеле пока нет гостей.")
         return
     
-    response = "📋 Список гостей:\n\n"
-    for guest in sorted(hotel.guests.values(), key=lambda g: g.guest_id):
-        response += f"{guest}\n{guest.display_info()}\n\n"
-    
-    bot.reply_to(message, response)
+    parts = ["📋 Список гостей:\n\n"]
+    parts.extend(f"{guest}\n{guest.display_info()}\n\n" for guest in guests)
+    reply(message, "".join(parts))
 
 
 @bot.message_handler(commands=['register'])
 def register_guest_start(message):
-    msg = bot.reply_to(message, "Введите ФИО нового гостя:")
-    bot.register_next_step_handler(msg, process_guest_name)
+    reply(message, "Введите ФИО нового гостя:")
+    bot.register_next_step_handler(message, process_guest_name)
 
 
 def process_guest_name(message):
     try:
-        user_states[message.chat.id] = {'name': message.text}
-        msg = bot.reply_to(message, "Введите паспортные данные гостя:")
-        bot.register_next_step_handler(msg, process_guest_passport)
+        start_state(message.chat.id, name=message.text)
+        reply(message, "Введите паспортные данные гостя:")
+        bot.register_next_step_handler(message, process_guest_passport)
     except Exception as e:
-        bot.reply_to(message, f"❌ Ошибка: {e}")
+        reply(message, f"❌ Ошибка: {e}")
 
 
 def process_guest_passport(message):
     try:
-        user_states[message.chat.id]['passport'] = message.text
-        msg = bot.reply_to(message, "Введите телефон гостя:")
-        bot.register_next_step_handler(msg, process_guest_phone)
+        if continue_state(message, passport=message.text) is None:
+            return
+        reply(message, "Введите телефон гостя:")
+        bot.register_next_step_handler(message, process_guest_phone)
     except Exception as e:
-        bot.reply_to(message, f"❌ Ошибка: {e}")
+        reply(message, f"❌ Ошибка: {e}")
 
 
 def process_guest_phone(message):
     try:
-        data = user_states[message.chat.id]
-        data['phone'] = message.text
+        data = continue_state(message, phone=message.text)
+        if data is None:
+            return
         
         guest = hotel.register_guest(data['name'], data['passport'], data['phone'])
-        bot.reply_to(message, f"✅ Гость успешно зарегистрирован:\n{guest.display_info()}")
-        del user_states[message.chat.id]
-    except ValueError as e:
-        bot.reply_to(message, f"❌ Ошибка: {e}")
+        reply(message, f"✅ Гость успешно зарегистрирован:\n{guest.display_info()}")
+        finish_state(message.chat.id)
+    except (ValueError, GuestError) as e:
+        reply(message, f"❌ Ошибка: {e}")
     except Exception as e:
-        bot.reply_to(message, f"❌ Неизвестная ошибка: {e}")
+        reply(message, f"❌ Неизвестная ошибка: {e}")
 
 
 @bot.message_handler(commands=['capsules'])
 def list_capsules(message):
-    if not hotel.capsules:
-        bot.reply_to(message, "В отеле пока нет капсул.")
+    capsules = hotel.capsules_snapshot()
+    if not capsules:
+        reply(message, "В отеле пока нет капсул.")
         return
     
-    response = "🚪 Список капсул:\n\n"
-    for capsule in sorted(hotel.capsules.values(), key=lambda c: c.capsule_id):
-        response += f"{capsule}\n{capsule.display_info()}\n\n"
-    
-    bot.reply_to(message, response)
+    parts = ["🚪 Список капсул:\n\n"]
+    parts.extend(f"{capsule}\n{capsule.display_info()}\n\n" for capsule in capsules)
+    reply(message, "".join(parts))
 
 
 @bot.message_handler(commands=['book'])
 def book_start(message):
-    if not hotel.guests:
-        bot.reply_to(message, "Для бронирования сначала зарегистрируйте гостя.")
+    guests = hotel.guests_snapshot()
+    if not guests:
+        reply(message, "Для бронирования сначала зарегистрируйте гостя.")
         return
     
-    guests_list = "👥 Выберите гостя (введите ID):\n\n"
-    for guest in hotel.guests.values():
-        guests_list += f"{guest.guest_id}. {guest.name}\n"
-    
-    msg = bot.reply_to(message, guests_list)
-    bot.register_next_step_handler(msg, process_booking_guest)
+    parts = [GUESTS_HEADER]
+    parts.extend(f"{guest.guest_id}. {guest.name}\n" for guest in guests)
+    reply(message, "".join(parts))
+    bot.register_next_step_handler(message, process_booking_guest)
 
 
 def process_booking_guest(message):
     try:
         guest_id = int(message.text)
         if guest_id not in hotel.guests:
-            bot.reply_to(message, "❌ Неверный ID гостя. Попробуйте снова.")
+            reply(message, "❌ Неверный ID гостя. Попробуйте снова.")
             return
         
-        user_states[message.chat.id] = {'guest_id': guest_id}
+        start_state(message.chat.id, guest_id=guest_id)
         
         available = hotel.get_available_capsules()
         if not available:
-            bot.reply_to(message, "❌ Нет доступных капсул для бронирования.")
+            reply(message, "❌ Нет доступных капсул для бронирования.")
             return
         
-        capsules_list = "🚪 Выберите капсулу (введите ID):\n\n"
-        for capsule in available:
-            capsules_list += f"{capsule.capsule_id}. {capsule.type} - {capsule.price_per_night:.2f} руб./ночь\n"
-        
-        msg = bot.reply_to(message, capsules_list)
-        bot.register_next_step_handler(msg, process_booking_capsule)
+        parts = [CAPSULES_HEADER]
+        parts.extend(f"{capsule.capsule_id}. {capsule.type} - {capsule.price_per_night:.2f} руб./ночь\n"
+                     for capsule in available)
+        reply(message, "".join(parts))
+        bot.register_next_step_handler(message, process_booking_capsule)
     except ValueError:
-        bot.reply_to(message, "❌ Пожалуйста, введите числовой ID гостя.")
+        reply(message, "❌ Пожалуйста, введите числовой ID гостя.")
 
 
 def process_booking_capsule(message):
     try:
         capsule_id = int(message.text)
         if capsule_id not in hotel.capsules:
-            bot.reply_to(message, "❌ Неверный ID капсулы. Попробуйте снова.")
+            reply(message, "❌ Неверный ID капсулы. Попробуйте снова.")
             return
         
-        user_states[message.chat.id]['capsule_id'] = capsule_id
-        msg = bot.reply_to(message, "📅 Введите дату заезда (в формате ГГГГ-ММ-ДД):")
-        bot.register_next_step_handler(msg, process_booking_start_date)
+        if continue_state(message, capsule_id=capsule_id) is None:
+            return
+        reply(message, "📅 Введите дату заезда (в формате ГГГГ-ММ-ДД):")
+        bot.register_next_step_handler(message, process_booking_start_date)
     except ValueError:
-        bot.reply_to(message, "❌ Пожалуйста, введите числовой ID капсулы.")
+        reply(message, "❌ Пожалуйста, введите числовой ID капсулы.")
 
 
 def process_booking_start_date(message):
-    try:
-        start_date = datetime.date.fromisoformat(message.text)
-        today = datetime.date.today()
-        
-        if start_date < today:
-            bot.reply_to(message, "❌ Дата заезда не может быть в прошлом. Попробуйте снова.")
-            return
-        
-        user_states[message.chat.id]['start_date'] = start_date
-        msg = bot.reply_to(message, "📅 Введите дату выезда (в формате ГГГГ-ММ-ДД):")
-        bot.register_next_step_handler(msg, process_booking_end_date)
-    except ValueError:
-        bot.reply_to(message, "❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД.")
+    start_date = parse_iso_date(message.text)
+    if start_date is None:
+        reply(message, DATE_FORMAT_ERROR)
+        return
+    
+    if start_date < today_cached():
+        reply(message, "❌ Дата заезда не может быть в прошлом. Попробуйте снова.")
+        return
+    
+    if continue_state(message, start_date=start_date) is None:
+        return
+    reply(message, "📅 Введите дату выезда (в формате ГГГГ-ММ-ДД):")
+    bot.register_next_step_handler(message, process_booking_end_date)
 
 
 def process_booking_end_date(message):
-    try:
-        end_date = datetime.date.fromisoformat(message.text)
-        data = user_states[message.chat.id]
-        start_date = data['start_date']
-        
-        if end_date <= start_date:
-            bot.reply_to(message, "❌ Дата выезда должна быть позже даты заезда. Попробуйте снова.")
-            return
-        
-        if (end_date - start_date).days > 30:
-            bot.reply_to(message, "❌ Максимальный срок бронирования - 30 дней. Попробуйте снова.")
-            return
-        
-        try:
-            booking = hotel.create_booking(
-                data['guest_id'],
-                data['capsule_id'],
-                start_date,
-                end_date
-            )
-            bot.reply_to(message, f"✅ Бронирование успешно создано!\n{booking.display_info()}")
-            del user_states[message.chat.id]
-        except ValueError as e:
-            bot.reply_to(message, f"❌ Ошибка при создании бронирования: {e}")
+    end_date = parse_iso_date(message.text)
+    if end_date is None:
+        reply(message, DATE_FORMAT_ERROR)
+        return
     
-    except ValueError:
-        bot.reply_to(message, "❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД.")
+    data = continue_state(message)
+    if data is None:
+        return
+    start_date = data['start_date']
+    
+    if end_date <= start_date:
+        reply(message, "❌ Дата выезда должна быть позже даты заезда. Попробуйте снова.")
+        return
+    
+    if (end_date - start_date).days > 30:
+        reply(message, "❌ Максимальный срок бронирования - 30 дней. Попробуйте снова.")
+        return
+    
+    try:
+        booking = hotel.create_booking(
+            data['guest_id'],
+            data['capsule_id'],
+            start_date,
+            end_date
+        )
+        reply(message, f"✅ Бронирование успешно создано!\n{booking.display_info()}")
+        finish_state(message.chat.id)
+    except HotelBaseError as e:
+        reply(message, f"❌ Ошибка при создании бронирования: {e}")
 
 
 @bot.message_handler(commands=['bookings'])
 def list_bookings(message):
-    if not hotel.bookings:
-        bot.reply_to(message, "Нет активных бронирований.")
+    bookings = hotel.bookings_snapshot()
+    if not bookings:
+        reply(message, "Нет активных бронирований.")
         return
     
-    response = "📋 Список бронирований:\n\n"
-    for booking in sorted(hotel.bookings.values(), key=lambda b: b.booking_id):
-        response += f"{booking}\n{booking.display_info()}\n\n"
-    
-    bot.reply_to(message, response)
+    parts = ["📋 Список бронирований:\n\n"]
+    parts.extend(f"{booking}\n{booking.display_info()}\n\n" for booking in bookings)
+    reply(message, "".join(parts))
 
 
 @bot.message_handler(commands=['checkout'])
 def checkout_start(message):
-    if not hotel.bookings:
-        bot.reply_to(message, "Нет активных бронирований для выселения.")
+    bookings = hotel.bookings_snapshot()
+    if not bookings:
+        reply(message, "Нет активных бронирований для выселения.")
         return
     
-    bookings_list = "📋 Выберите бронирование для выселения (введите ID):\n\n"
-    for booking in hotel.bookings.values():
-        bookings_list += f"{booking.booking_id}. {booking.guest.name} - Капсула #{booking.capsule.capsule_id}\n"
-    
-    msg = bot.reply_to(message, bookings_list)
-    bot.register_next_step_handler(msg, process_check_out)
+    parts = ["📋 Выберите бронирование для выселения (введите ID):\n\n"]
+    parts.extend(f"{booking.booking_id}. {booking.guest.name} - Капсула #{booking.capsule.capsule_id}\n"
+                 for booking in bookings)
+    reply(message, "".join(parts))
+    bot.register_next_step_handler(message, process_check_out)
 
 
 def process_check_out(message):
@@ -754,51 +1329,48 @@ def process_check_out(message):
         
         try:
             hotel.check_out(booking_id)
-            bot.reply_to(message, f"✅ Гость успешно выселен, капсула освобождена.")
-        except ValueError as e:
-            bot.reply_to(message, f"❌ Ошибка: {e}")
+            reply(message, f"✅ Гость успешно выселен, капсула освобождена.")
+        except HotelBaseError as e:
+            reply(message, f"❌ Ошибка: {e}")
     
     except ValueError:
-        bot.reply_to(message, "❌ Пожалуйста, введите числовой ID бронирования.")
+        reply(message, "❌ Пожалуйста, введите числовой ID бронирования.")
 
 
 @bot.message_handler(commands=['stats'])
 def show_stats(message):
     stats = hotel.get_guest_statistics()
     if not stats:
-        bot.reply_to(message, "Нет данных для статистики.")
+        reply(message, "Нет данных для статистики.")
         return
     
-    response = "📊 Статистика по гостям (общая сумма бронирований):\n\n"
-    for name, total in sorted(stats.items(), key=lambda item: item[1], reverse=True):
-        response += f"👤 {name}: {total:.2f} руб.\n"
-    
-    bot.reply_to(message, response)
+    parts = ["📊 Статистика по гостям (общая сумма бронирований):\n\n"]
+    parts.extend(f"👤 {name}: {total:.2f} руб.\n"
+                 for name, total in nlargest(STATS_TOP_N, stats.items(), key=itemgetter(1)))
+    reply(message, "".join(parts))
 
 
 @bot.message_handler(commands=['recent'])
 def show_recent_bookings(message):
-    recent = Booking.get_recent_bookings()
+    recent = hotel.get_recent_bookings()
     if not recent:
-        bot.reply_to(message, "Нет данных о последних бронированиях.")
+        reply(message, "Нет данных о последних бронированиях.")
         return
     
-    response = "⏳ Последние бронирования:\n\n"
-    for booking in recent:
-        response += f"{booking}\n{booking.display_info()}\n\n"
-    
-    bot.reply_to(message, response)
+    parts = ["⏳ Последние бронирования:\n\n"]
+    parts.extend(f"{booking}\n{booking.display_info()}\n\n" for booking in recent)
+    reply(message, "".join(parts))
 
 @bot.message_handler(commands=['max_guest'])
 def show_max_guest(message):
     try:
         guest = hotel.find_guest_with_max_bookings()
         if guest:
-            bot.reply_to(message, f"Гость с максимальным числом бронирований:\n{guest.display_info()}")
+            reply(message, f"Гость с максимальным числом бронирований:\n{guest.display_info()}")
         else:
-            bot.reply_to(message, "Нет гостей в отеле")
+            reply(message, "Нет гостей в отеле")
     except Exception as e:
-        bot.reply_to(message, f"Ошибка: {e}")
+        reply(message, f"Ошибка: {e}")
 
 @bot.message_handler(commands=['demo_vip'])
 def demo_vip(message):
@@ -806,19 +1378,19 @@ def demo_vip(message):
         # Создаем временного VIP гостя
         vip = VIPGuest(999, "Иван VIP", 3)
         
-        # Создаем тестовое бронирование для демонстрации
-        capsule = next(iter(hotel.capsules.values()))  # Берем первую капсулу
-        today = datetime.date.today()
-        booking = Booking(999, vip, capsule, today, today + datetime.timedelta(days=3))
+        # Пример бронирования на первую капсулу; черновик не занимает её в отеле
+        capsule = hotel.capsules_snapshot()[0]
+        today = today_cached()
+        booking = Booking.draft(999, vip, capsule, today, today + datetime.timedelta(days=3))
         
         response = (f"Демо VIP гостя:\n{vip.display_info()}\n\n"
                   f"Пример бронирования:\n{booking.display_info()}\n\n"
                   f"Преимущества:\n{vip.get_benefits(booking)}\n\n"
                   f"repr: {repr(vip)}")
         
-        bot.reply_to(message, response)
+        reply(message, response)
     except Exception as e:
-        bot.reply_to(message, f"Ошибка: {e}")
+        reply(message, f"Ошибка: {e}")
 
 def run_gui():
     app = QApplication(sys.argv)
@@ -833,7 +1405,9 @@ def run_gui():
 
 def run_bot():
     print("Бот запущен...")
-    bot.infinity_polling()
+    # Длинный опрос: getUpdates висит на сервере до 25 с и отдаёт все накопившиеся
+    # обновления разом; других типов обновлений, кроме сообщений, бот не обрабатывает
+    bot.infinity_polling(timeout=30, long_polling_timeout=25, allowed_updates=['message'])
 
 if __name__ == '__main__':
     # Создание потоков для запуска обоих процессов
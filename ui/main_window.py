@@ -1,16 +1,35 @@
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-    QPushButton, QTableWidget, QTableWidgetItem, QHeaderView,
+    QPushButton, QTableView, QAbstractItemView, QHeaderView,
     QDateEdit, QComboBox, QMessageBox, QLineEdit, QTabWidget
 )
-from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtCore import Qt, QDate, QTimer
+import calendar
 import datetime
-from typing import Dict
+from operator import attrgetter
+from typing import Dict, Optional, Tuple
+
+from ui.table_models import (BookingTableModel, GuestTableModel, CapsuleTableModel,
+                             LABEL_PAID, LABEL_UNPAID, LABEL_AVAILABLE, LABEL_TAKEN)
+
+_BY_START_DATE_AND_ID = attrgetter('start_date', 'booking_id')
+_BY_GUEST_ID = attrgetter('guest_id')
+_BY_CAPSULE_ID = attrgetter('capsule_id')
+
+# Пауза в наборе (мс), после которой применяется поиск гостей
+SEARCH_DEBOUNCE_MS = 200
 
 class MainWindow(QMainWindow):
     def __init__(self, hotel):
         super().__init__()
         self.hotel = hotel
+        # guest_id -> имя, паспорт и телефон в нижнем регистре через \0 (для поиска)
+        self._guest_search_index: Dict[int, str] = {}
+        # Тексты карточек по ID; сбрасываются действиями окна, меняющими бронь (forget_details).
+        # Карточка гостя зависит от дня, поэтому хранится вместе с датой построения
+        self._booking_details: Dict[int, str] = {}
+        self._capsule_details: Dict[int, str] = {}
+        self._guest_details: Dict[int, Tuple[datetime.date, str]] = {}
         self.setWindowTitle("Админ-панель отеля")
         self.setGeometry(100, 100, 1000, 600)
         
@@ -65,15 +84,8 @@ class MainWindow(QMainWindow):
         layout.addLayout(filter_layout)
         
         # Таблица бронирований
-        self.bookings_table = QTableWidget()
-        self.bookings_table.setColumnCount(7)
-        self.bookings_table.setHorizontalHeaderLabels([
-            "ID", "Гость", "Капсула", "Дата заезда", "Дата выезда", 
-            "Сумма", "Статус оплаты"
-        ])
-        self.bookings_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.bookings_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.bookings_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.bookings_model = BookingTableModel(self)
+        self.bookings_table = self.create_table(self.bookings_model)
         self.bookings_table.doubleClicked.connect(self.show_booking_details)
         layout.addWidget(self.bookings_table)
         
@@ -102,19 +114,18 @@ class MainWindow(QMainWindow):
         search_layout = QHBoxLayout()
         self.guest_search = QLineEdit()
         self.guest_search.setPlaceholderText("Поиск по имени или паспорту...")
-        self.guest_search.textChanged.connect(self.load_guests)
+        # Фильтруем не на каждое нажатие, а когда ввод затих
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self._search_timer.timeout.connect(self.load_guests)
+        self.guest_search.textChanged.connect(self._search_timer.start)
         search_layout.addWidget(self.guest_search)
         layout.addLayout(search_layout)
         
         # Таблица гостей
-        self.guests_table = QTableWidget()
-        self.guests_table.setColumnCount(4)
-        self.guests_table.setHorizontalHeaderLabels([
-            "ID", "Имя", "Паспорт", "Телефон"
-        ])
-        self.guests_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.guests_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.guests_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.guests_model = GuestTableModel(self)
+        self.guests_table = self.create_table(self.guests_model)
         self.guests_table.doubleClicked.connect(self.show_guest_details)
         layout.addWidget(self.guests_table)
         
@@ -153,14 +164,8 @@ class MainWindow(QMainWindow):
         layout.addLayout(filter_layout)
         
         # Таблица капсул
-        self.capsules_table = QTableWidget()
-        self.capsules_table.setColumnCount(5)
-        self.capsules_table.setHorizontalHeaderLabels([
-            "ID", "Тип", "Цена за ночь", "Доступность", "Текущее бронирование"
-        ])
-        self.capsules_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.capsules_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.capsules_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.capsules_model = CapsuleTableModel(self)
+        self.capsules_table = self.create_table(self.capsules_model)
         self.capsules_table.doubleClicked.connect(self.show_capsule_details)
         layout.addWidget(self.capsules_table)
         
@@ -177,191 +182,225 @@ class MainWindow(QMainWindow):
         
         layout.addLayout(button_layout)
     
+    def create_table(self, model) -> QTableView:
+        table = QTableView()
+        table.setModel(model)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        return table
+    
+    def selected_row(self, table: QTableView) -> Optional[int]:
+        """Номер выделенной строки модели"""
+        rows = table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return rows[0].row()
+    
+    def selected_id(self, table: QTableView) -> Optional[int]:
+        """ID объекта выделенной строки"""
+        row = self.selected_row(table)
+        if row is None:
+            return None
+        return table.model().index(row, 0).data(Qt.UserRole)
+    
     def load_data(self):
         self.load_bookings()
         self.load_guests()
         self.load_capsules()
     
     def load_bookings(self):
-        self.bookings_table.setRowCount(0)
-        
         date_filter = self.date_filter.currentText()
         status_filter = self.status_filter.currentText()
         today = datetime.date.today()
         
-        for booking in sorted(self.hotel.bookings.values(), key=lambda b: b.start_date):
-            # Фильтрация по дате
-            if date_filter == "Сегодня" and booking.start_date != today:
-                continue
-            if date_filter == "Завтра" and booking.start_date != today + datetime.timedelta(days=1):
-                continue
-            if date_filter == "На этой неделе" and (booking.start_date < today or booking.start_date > today + datetime.timedelta(days=7)):
-                continue
-            if date_filter == "В этом месяце" and (booking.start_date < today or booking.start_date.month != today.month):
-                continue
-            
-            # Фильтрация по статусу
-            if status_filter == "Активные" and (booking.end_date < today or booking.start_date > today):
-                continue
-            if status_filter == "Завершенные" and booking.end_date >= today:
-                continue
-            if status_filter == "Оплаченные" and not booking.is_paid:
-                continue
-            if status_filter == "Неоплаченные" and booking.is_paid:
-                continue
-            
-            row = self.bookings_table.rowCount()
-            self.bookings_table.insertRow(row)
-            
-            self.bookings_table.setItem(row, 0, QTableWidgetItem(str(booking.booking_id)))
-            self.bookings_table.setItem(row, 1, QTableWidgetItem(booking.guest.name))
-            self.bookings_table.setItem(row, 2, QTableWidgetItem(f"{booking.capsule.type} (#{booking.capsule.capsule_id})"))
-            self.bookings_table.setItem(row, 3, QTableWidgetItem(booking.start_date.strftime("%d.%m.%Y")))
-            self.bookings_table.setItem(row, 4, QTableWidgetItem(booking.end_date.strftime("%d.%m.%Y")))
-            self.bookings_table.setItem(row, 5, QTableWidgetItem(f"{booking.calculate_total():.2f} руб."))
-            self.bookings_table.setItem(row, 6, QTableWidgetItem("Оплачено" if booking.is_paid else "Не оплачено"))
+        # Фильтрация по дате: берём только нужные дни из индекса по дате заезда
+        if date_filter == "Сегодня":
+            rows = self.hotel.bookings_starting_between(today, today)
+        elif date_filter == "Завтра":
+            tomorrow = today + datetime.timedelta(days=1)
+            rows = self.hotel.bookings_starting_between(tomorrow, tomorrow)
+        elif date_filter == "На этой неделе":
+            rows = self.hotel.bookings_starting_between(today, today + datetime.timedelta(days=7))
+        elif date_filter == "В этом месяце":
+            month_end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+            rows = self.hotel.bookings_starting_between(today, month_end)
+        elif status_filter == "Оплаченные":
+            # Без фильтра по дате оплаченные берём сразу из множества оплаченных
+            bookings = self.hotel.bookings
+            rows = sorted((bookings[booking_id] for booking_id in self.hotel.paid_booking_ids()),
+                          key=_BY_START_DATE_AND_ID)
+        else:
+            rows = self.hotel.bookings_by_start_date()
+        
+        # Фильтрация по статусу. Активные и завершенные бронирования заехали
+        # не позже сегодняшнего дня, поэтому без фильтра по дате хватает начала списка
+        if status_filter == "Активные":
+            if date_filter == "Все":
+                rows = self.hotel.bookings_starting_between(datetime.date.min, today)
+            rows = [b for b in rows if b.end_date >= today and b.start_date <= today]
+        elif status_filter == "Завершенные":
+            if date_filter == "Все":
+                rows = self.hotel.bookings_starting_between(datetime.date.min, today)
+            rows = [b for b in rows if b.end_date < today]
+        elif status_filter == "Оплаченные" and date_filter != "Все":
+            paid = self.hotel.paid_booking_ids()
+            rows = [b for b in rows if b.booking_id in paid]
+        elif status_filter == "Неоплаченные":
+            paid = self.hotel.paid_booking_ids()
+            rows = [b for b in rows if b.booking_id not in paid]
+        
+        self.bookings_model.set_rows(rows)
+    
+    def guest_search_text(self, guest) -> str:
+        """Строка для поиска по гостю; данные гостя не меняются, поэтому считается один раз"""
+        text = self._guest_search_index.get(guest.guest_id)
+        if text is None:
+            text = f"{guest.name}\0{guest.passport}\0{guest.phone}".lower()
+            self._guest_search_index[guest.guest_id] = text
+        return text
     
     def load_guests(self):
-        self.guests_table.setRowCount(0)
         search_text = self.guest_search.text().lower()
+        guests = sorted(self.hotel.guests.values(), key=_BY_GUEST_ID)
         
-        for guest in sorted(self.hotel.guests.values(), key=lambda g: g.guest_id):
-            if (search_text in guest.name.lower() or 
-                search_text in guest.passport.lower() or 
-                search_text in guest.phone.lower() or 
-                not search_text):
-                
-                row = self.guests_table.rowCount()
-                self.guests_table.insertRow(row)
-                
-                self.guests_table.setItem(row, 0, QTableWidgetItem(str(guest.guest_id)))
-                self.guests_table.setItem(row, 1, QTableWidgetItem(guest.name))
-                self.guests_table.setItem(row, 2, QTableWidgetItem(guest.passport))
-                self.guests_table.setItem(row, 3, QTableWidgetItem(guest.phone))
+        if search_text:
+            index_text = self.guest_search_text
+            guests = [guest for guest in guests if search_text in index_text(guest)]
+        self.guests_model.set_rows(guests)
     
     def load_capsules(self):
-        self.capsules_table.setRowCount(0)
-        
         type_filter = self.type_filter.currentText()
         availability_filter = self.availability_filter.currentText()
         
-        for capsule in sorted(self.hotel.capsules.values(), key=lambda c: c.capsule_id):
-            # Фильтрация по типу
-            if type_filter != "Все" and capsule.type != type_filter:
-                continue
-                
-            # Фильтрация по доступности
-            if availability_filter == "Доступные" and not capsule.is_available:
-                continue
-            if availability_filter == "Занятые" and capsule.is_available:
-                continue
-            
-            row = self.capsules_table.rowCount()
-            self.capsules_table.insertRow(row)
-            
-            self.capsules_table.setItem(row, 0, QTableWidgetItem(str(capsule.capsule_id)))
-            self.capsules_table.setItem(row, 1, QTableWidgetItem(capsule.type))
-            self.capsules_table.setItem(row, 2, QTableWidgetItem(f"{capsule.price_per_night:.2f} руб."))
-            self.capsules_table.setItem(row, 3, QTableWidgetItem("Доступна" if capsule.is_available else "Занята"))
-            
-            booking_info = ""
-            if capsule.current_booking:
-                booking = capsule.current_booking
-                booking_info = f"Гость: {booking.guest.name} ({booking.start_date} - {booking.end_date})"
-            self.capsules_table.setItem(row, 4, QTableWidgetItem(booking_info))
+        # Тип выбирает готовую группу капсул, доступность — готовый список;
+        # фильтр проходит только по выбранной части
+        if type_filter != "Все":
+            rows = self.hotel.capsules_of_type(type_filter)
+            if availability_filter == "Доступные":
+                rows = [capsule for capsule in rows if capsule.is_available]
+            elif availability_filter == "Занятые":
+                rows = [capsule for capsule in rows if not capsule.is_available]
+        elif availability_filter == "Доступные":
+            rows = self.hotel.capsules_by_availability(True)
+        elif availability_filter == "Занятые":
+            rows = self.hotel.capsules_by_availability(False)
+        else:
+            rows = sorted(self.hotel.capsules.values(), key=_BY_CAPSULE_ID)
+        
+        self.capsules_model.set_rows(rows)
+    
+    def booking_details_text(self, booking) -> str:
+        """Текст карточки бронирования; строится один раз до изменения брони"""
+        details = self._booking_details.get(booking.booking_id)
+        if details is None:
+            details = self._booking_details[booking.booking_id] = (
+                f"Бронирование #{booking.booking_id}\n\n"
+                f"Гость: {booking.guest.name} (ID: {booking.guest.guest_id})\n"
+                f"Паспорт: {booking.guest.passport}\n"
+                f"Телефон: {booking.guest.phone}\n\n"
+                f"Капсула: {booking.capsule.type} (ID: {booking.capsule.capsule_id})\n"
+                f"Цена за ночь: {booking.capsule.price_str}\n\n"
+                f"Дата заезда: {booking.start_date_str}\n"
+                f"Дата выезда: {booking.end_date_str}\n"
+                f"Количество ночей: {(booking.end_date - booking.start_date).days}\n\n"
+                f"Общая сумма: {booking.total_str}\n"
+                f"Статус оплаты: {LABEL_PAID if booking.is_paid else LABEL_UNPAID}"
+            )
+        return details
+    
+    def guest_details_text(self, guest) -> str:
+        """Текст карточки гостя; активные брони зависят от дня, поэтому кэш привязан к дате"""
+        today = datetime.date.today()
+        cached = self._guest_details.get(guest.guest_id)
+        if cached is not None and cached[0] == today:
+            return cached[1]
+        
+        active_bookings = guest.get_active_bookings(today)
+        parts = [
+            f"Гость #{guest.guest_id}\n\n"
+            f"Имя: {guest.name}\n"
+            f"Паспорт: {guest.passport}\n"
+            f"Телефон: {guest.phone}\n\n"
+            f"Активных бронирований: {len(active_bookings)}\n"
+        ]
+        if active_bookings:
+            parts.append("\nАктивные бронирования:\n")
+            parts.extend(f"- Бронь #{booking.booking_id}: "
+                         f"{booking.capsule.type} (с {booking.start_date} по {booking.end_date})\n"
+                         for booking in active_bookings)
+        details = "".join(parts)
+        self._guest_details[guest.guest_id] = (today, details)
+        return details
+    
+    def capsule_details_text(self, capsule) -> str:
+        """Текст карточки капсулы; строится один раз до смены её бронирования"""
+        details = self._capsule_details.get(capsule.capsule_id)
+        if details is None:
+            details = (
+                f"Капсула #{capsule.capsule_id}\n\n"
+                f"Тип: {capsule.type}\n"
+                f"Цена за ночь: {capsule.price_str}\n"
+                f"Статус: {LABEL_AVAILABLE if capsule.is_available else LABEL_TAKEN}\n"
+            )
+            booking = capsule.current_booking
+            if booking:
+                details += (
+                    f"\nТекущее бронирование:\n"
+                    f"ID: {booking.booking_id}\n"
+                    f"Гость: {booking.guest.name} (ID: {booking.guest.guest_id})\n"
+                    f"Период: {booking.start_date} - {booking.end_date}\n"
+                    f"Статус оплаты: {LABEL_PAID if booking.is_paid else LABEL_UNPAID}"
+                )
+            self._capsule_details[capsule.capsule_id] = details
+        return details
+    
+    def forget_details(self, booking):
+        """Сбрасывает карточки, на которые влияет изменение брони: её саму,
+        её капсулу (там статус текущей брони) и её гостя (там активные брони)"""
+        self._booking_details.pop(booking.booking_id, None)
+        self._capsule_details.pop(booking.capsule.capsule_id, None)
+        self._guest_details.pop(booking.guest.guest_id, None)
     
     def show_booking_details(self):
-        selected = self.bookings_table.selectedItems()
-        if not selected:
+        booking_id = self.selected_id(self.bookings_table)
+        if booking_id is None:
             return
         
-        booking_id = int(selected[0].text())
         booking = self.hotel.bookings.get(booking_id)
         if not booking:
             return
         
-        details = (
-            f"Бронирование #{booking.booking_id}\n\n"
-            f"Гость: {booking.guest.name} (ID: {booking.guest.guest_id})\n"
-            f"Паспорт: {booking.guest.passport}\n"
-            f"Телефон: {booking.guest.phone}\n\n"
-            f"Капсула: {booking.capsule.type} (ID: {booking.capsule.capsule_id})\n"
-            f"Цена за ночь: {booking.capsule.price_per_night:.2f} руб.\n\n"
-            f"Дата заезда: {booking.start_date.strftime('%d.%m.%Y')}\n"
-            f"Дата выезда: {booking.end_date.strftime('%d.%m.%Y')}\n"
-            f"Количество ночей: {(booking.end_date - booking.start_date).days}\n\n"
-            f"Общая сумма: {booking.calculate_total():.2f} руб.\n"
-            f"Статус оплаты: {'Оплачено' if booking.is_paid else 'Не оплачено'}"
-        )
-        
-        QMessageBox.information(self, "Детали бронирования", details)
+        QMessageBox.information(self, "Детали бронирования", self.booking_details_text(booking))
     
     def show_guest_details(self):
-        selected = self.guests_table.selectedItems()
-        if not selected:
+        guest_id = self.selected_id(self.guests_table)
+        if guest_id is None:
             return
         
-        guest_id = int(selected[0].text())
         guest = self.hotel.guests.get(guest_id)
         if not guest:
             return
         
-        active_bookings = [b for b in guest.bookings if b.end_date >= datetime.date.today()]
-        
-        details = (
-            f"Гость #{guest.guest_id}\n\n"
-            f"Имя: {guest.name}\n"
-            f"Паспорт: {guest.passport}\n"
-            f"Телефон: {guest.phone}\n\n"
-            f"Активных бронирований: {len(active_bookings)}\n"
-        )
-        
-        if active_bookings:
-            details += "\nАктивные бронирования:\n"
-            for booking in active_bookings:
-                details += (
-                    f"- Бронь #{booking.booking_id}: "
-                    f"{booking.capsule.type} (с {booking.start_date} по {booking.end_date})\n"
-                )
-        
-        QMessageBox.information(self, "Детали гостя", details)
+        QMessageBox.information(self, "Детали гостя", self.guest_details_text(guest))
     
     def show_capsule_details(self):
-        selected = self.capsules_table.selectedItems()
-        if not selected:
+        capsule_id = self.selected_id(self.capsules_table)
+        if capsule_id is None:
             return
         
-        capsule_id = int(selected[0].text())
         capsule = self.hotel.capsules.get(capsule_id)
         if not capsule:
             return
         
-        details = (
-            f"Капсула #{capsule.capsule_id}\n\n"
-            f"Тип: {capsule.type}\n"
-            f"Цена за ночь: {capsule.price_per_night:.2f} руб.\n"
-            f"Статус: {'Доступна' if capsule.is_available else 'Занята'}\n"
-        )
-        
-        if capsule.current_booking:
-            booking = capsule.current_booking
-            details += (
-                f"\nТекущее бронирование:\n"
-                f"ID: {booking.booking_id}\n"
-                f"Гость: {booking.guest.name} (ID: {booking.guest.guest_id})\n"
-                f"Период: {booking.start_date} - {booking.end_date}\n"
-                f"Статус оплаты: {'Оплачено' if booking.is_paid else 'Не оплачено'}"
-            )
-        
-        QMessageBox.information(self, "Детали капсулы", details)
+        QMessageBox.information(self, "Детали капсулы", self.capsule_details_text(capsule))
     
     def mark_as_paid(self):
-        selected = self.bookings_table.selectedItems()
-        if not selected:
+        booking_id = self.selected_id(self.bookings_table)
+        if booking_id is None:
             QMessageBox.warning(self, "Ошибка", "Выберите бронирование")
             return
         
-        booking_id = int(selected[0].text())
         booking = self.hotel.bookings.get(booking_id)
         if not booking:
             return
@@ -370,18 +409,22 @@ class MainWindow(QMainWindow):
             QMessageBox.information(self, "Информация", "Бронирование уже оплачено")
             return
         
-        booking.mark_as_paid()
-        booking.save_to_db()
-        self.load_bookings()
+        self.hotel.mark_booking_paid(booking_id)
+        self.forget_details(booking)
+        # Меняется одна строка: под фильтром "Неоплаченные" она уходит, иначе перерисовывается
+        row = self.selected_row(self.bookings_table)
+        if self.status_filter.currentText() == "Неоплаченные":
+            self.bookings_model.remove_row(row)
+        else:
+            self.bookings_model.refresh_row(row)
         QMessageBox.information(self, "Успех", "Бронирование отмечено как оплаченное")
     
     def cancel_booking(self):
-        selected = self.bookings_table.selectedItems()
-        if not selected:
+        booking_id = self.selected_id(self.bookings_table)
+        if booking_id is None:
             QMessageBox.warning(self, "Ошибка", "Выберите бронирование")
             return
         
-        booking_id = int(selected[0].text())
         booking = self.hotel.bookings.get(booking_id)
         if not booking:
             return
@@ -398,9 +441,9 @@ class MainWindow(QMainWindow):
         
         if reply == QMessageBox.Yes:
             try:
-                booking.cancel()
-                del self.hotel.bookings[booking_id]
-                self.load_bookings()
+                self.hotel.check_out(booking_id)
+                self.forget_details(booking)
+                self.bookings_model.remove_row(self.selected_row(self.bookings_table))
                 QMessageBox.information(self, "Успех", "Бронирование отменено")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось отменить бронирование: {str(e)}")
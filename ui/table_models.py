@@ -0,0 +1,138 @@
+from operator import attrgetter
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Подписи статусов в таблицах
+LABEL_PAID = "Оплачено"
+LABEL_UNPAID = "Не оплачено"
+LABEL_AVAILABLE = "Доступна"
+LABEL_TAKEN = "Занята"
+
+
+class ColumnDef(NamedTuple):
+    """Колонка таблицы: заголовок и функция, дающая текст ячейки по объекту строки"""
+    header: str
+    text: Callable[[Any], str]
+
+
+class ObjectTableModel(QAbstractTableModel):
+    """Модель таблицы над списком объектов.
+
+    Текст ячеек строится в data() только для тех строк, которые Qt
+    действительно отрисовывает, и сразу для всей строки: повторные перерисовки
+    берут готовый кортеж. Смена фильтра — это замена списка и сброс модели.
+    Представлению строки отдаются порциями по FETCH_BATCH по мере прокрутки
+    (canFetchMore/fetchMore), так что большой список не раскладывается целиком.
+    """
+    COLUMNS: Sequence[ColumnDef] = ()
+    FETCH_BATCH = 100
+    # ID объекта строки, задаётся в наследниках; data() отдаёт его числом в роли Qt.UserRole
+    ROW_ID: Callable[[Any], int]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: List[Any] = []
+        self._texts: List[Optional[Tuple[str, ...]]] = []
+        self._loaded = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section].header
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.FETCH_BATCH, len(self._rows) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.UserRole:
+            return self.ROW_ID(self._rows[row])
+        if role != Qt.DisplayRole:
+            return None
+        texts = self._texts[row]
+        if texts is None:
+            obj = self._rows[row]
+            texts = self._texts[row] = tuple(column.text(obj) for column in self.COLUMNS)
+        return texts[index.column()]
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._rows = list(rows)
+        self._texts = [None] * len(self._rows)
+        self._loaded = min(self.FETCH_BATCH, len(self._rows))
+        self.endResetModel()
+
+    def row_object(self, row: int):
+        return self._rows[row]
+
+    def refresh_row(self, row: int):
+        """Перерисовывает одну строку после изменения её объекта"""
+        self._texts[row] = None
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def remove_row(self, row: int):
+        """Убирает одну строку, не пересобирая остальные"""
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._rows[row]
+        del self._texts[row]
+        self._loaded -= 1
+        self.endRemoveRows()
+
+
+class BookingTableModel(ObjectTableModel):
+    COLUMNS = (
+        ColumnDef("ID", lambda b: str(b.booking_id)),
+        ColumnDef("Гость", lambda b: b.guest.name),
+        ColumnDef("Капсула", lambda b: f"{b.capsule.type} (#{b.capsule.capsule_id})"),
+        ColumnDef("Дата заезда", attrgetter('start_date_str')),
+        ColumnDef("Дата выезда", attrgetter('end_date_str')),
+        ColumnDef("Сумма", attrgetter('total_str')),
+        ColumnDef("Статус оплаты", lambda b: LABEL_PAID if b.is_paid else LABEL_UNPAID),
+    )
+    ROW_ID = attrgetter('booking_id')
+
+
+class GuestTableModel(ObjectTableModel):
+    COLUMNS = (
+        ColumnDef("ID", lambda g: str(g.guest_id)),
+        ColumnDef("Имя", attrgetter('name')),
+        ColumnDef("Паспорт", attrgetter('passport')),
+        ColumnDef("Телефон", attrgetter('phone')),
+    )
+    ROW_ID = attrgetter('guest_id')
+
+
+def _current_booking_text(capsule) -> str:
+    booking = capsule.current_booking
+    if booking:
+        return f"Гость: {booking.guest.name} ({booking.start_date} - {booking.end_date})"
+    return ""
+
+
+class CapsuleTableModel(ObjectTableModel):
+    COLUMNS = (
+        ColumnDef("ID", lambda c: str(c.capsule_id)),
+        ColumnDef("Тип", attrgetter('type')),
+        ColumnDef("Цена за ночь", attrgetter('price_str')),
+        ColumnDef("Доступность", lambda c: LABEL_AVAILABLE if c.is_available else LABEL_TAKEN),
+        ColumnDef("Текущее бронирование", _current_booking_text),
+    )
+    ROW_ID = attrgetter('capsule_id')